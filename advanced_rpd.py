@@ -1,7 +1,7 @@
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-from scipy.optimize import curve_fit
+from functools import lru_cache
 
 def log_power_function(x, a, b):
     """定义对数函数: y = log(a * x^b)，用于拟合留存率"""
@@ -13,33 +13,58 @@ def fit_revenue_parameters(days, retention_rates):
     if np.all(retention_rates == 0):
         return 0, 0  # 返回特殊值表示全为0的情况
     
+    # 部分续订率为0或负数时无法取对数拟合
+    if np.any(retention_rates <= 0):
+        raise ValueError(f"续订率需全部大于0（全部为0表示不使用该方案），当前为{np.asarray(retention_rates).tolist()}")
+    
+    # log(y) = log(a) + b*log(x) 对 (log(a), b) 是线性的，直接用最小二乘闭式解
     log_retention_rates = np.log(retention_rates)
-    popt, _ = curve_fit(log_power_function, days, log_retention_rates)
-    return popt
+    b, log_a = np.polyfit(np.log(days), log_retention_rates, 1)
+    return np.exp(log_a), b
+
+# 不同周期的观测点（使用周期数而不是天数）
+PERIOD_POINTS = {
+    'week': np.array([1, 3, 7]),  # 1周、3周、7周
+    'month': np.array([1, 3, 7]),  # 1月、3月、7月
+    'quarter': np.array([1, 3, 4]),  # 1季、3季、4季
+    'year': np.array([1, 2, 3])  # 1年、2年、3年
+}
+
+# 不同周期的付费间隔天数
+PERIOD_DAYS = {
+    'week': 7,
+    'month': 30,
+    'quarter': 90,
+    'year': 365
+}
+
+@lru_cache(maxsize=512)
+def cached_fit_parameters(retention_rates, period_type):
+    """按 (续订率元组, 周期类型) 缓存拟合结果，避免重复拟合相同曲线
+    retention_rates: 对应周期点的续订率（tuple）
+    period_type: 'week', 'month', 'quarter', 或 'year'
+    """
+    a, b = fit_revenue_parameters(PERIOD_POINTS[period_type], np.array(retention_rates))
+    return a, b
+
+# 预测天数超过该值时不再构建 (激活日期数 × 天数) 的收入矩阵
+# 4000天时float32矩阵约64MB，计入中间结果后构建与计算RPD的峰值内存约0.5GB
+MAX_MATRIX_DAYS = 4_000
 
 class RevenueCalculator:
     def __init__(self):
         # 定义不同周期的观测点（使用周期数而不是天数）
-        self.week_points = np.array([1, 3, 7])  # 1周、3周、7周
-        self.month_points = np.array([1, 3, 7])  # 1月、3月、7月
-        self.quarter_points = np.array([1, 3, 4])  # 1季、3季、4季
-        self.year_points = np.array([1, 2, 3])  # 1年、2年、3年
+        self.week_points = PERIOD_POINTS['week']
+        self.month_points = PERIOD_POINTS['month']
+        self.quarter_points = PERIOD_POINTS['quarter']
+        self.year_points = PERIOD_POINTS['year']
 
     def fit_period_parameters(self, retention_rates, period_type):
         """根据不同周期拟合参数
         retention_rates: 对应周期点的续订率
         period_type: 'week', 'month', 'quarter', 或 'year'
         """
-        if period_type == 'week':
-            periods = self.week_points
-        elif period_type == 'month':
-            periods = self.month_points
-        elif period_type == 'quarter':
-            periods = self.quarter_points
-        else:  # year
-            periods = self.year_points
-        
-        return fit_revenue_parameters(periods, np.array(retention_rates))
+        return cached_fit_parameters(tuple(retention_rates), period_type)
 
     def calculate_retention_rate(self, days, a, b, period_type):
         """计算特定天数对应的留存率
@@ -51,89 +76,116 @@ class RevenueCalculator:
             return 0
         
         # 将天数转换为对应的周期数
-        if period_type == 'week':
-            periods = days / 7
-        elif period_type == 'month':
-            periods = days / 30
-        elif period_type == 'quarter':
-            periods = days / 90
-        else:  # year
-            periods = days / 365
+        periods = days / PERIOD_DAYS[period_type]
         
         return np.exp(log_power_function(periods, a, b))
 
-    def create_revenue_df(self, active_users, start_date, end_date, yearly_params):
-        """创建收入DataFrame"""
-        dates = pd.date_range(start=start_date, end=end_date)
-        
+    def create_revenue_curves(self, max_days, yearly_params):
+        """计算各激活年份的日收入曲线
+        max_days: 曲线覆盖的天数
+        返回 (years, revenue)，revenue[year_idx, day] 为该年份激活用户在第day天的收入
+        """
         # 为每年每种付费周期拟合参数
         year_params = {}
         for year, params in yearly_params.items():
             year_params[year] = {}
             for period in ['week', 'month', 'quarter', 'year']:
                 retention_rates, revenue_prop = params[period]
+                if revenue_prop == 0:
+                    # 收入占比为0的方案不参与计算，无需拟合
+                    year_params[year][period] = (0, 0, 0)
+                    continue
                 a, b = self.fit_period_parameters(retention_rates, period)
                 year_params[year][period] = (a, b, revenue_prop)
         
-        data = {'激活人数': [active_users] * len(dates)}
         base_revenue = 1000  # 总体基础收入
         
-        max_days = (pd.Timestamp(end_date) - pd.Timestamp(start_date)).days + 1
+        days = np.arange(max_days)
+        years = sorted(year_params)
+        
+        # 只保留至少有一个年份收入占比大于0且续订率不全为0的付费方案
+        def is_active(a, b, revenue_prop):
+            return revenue_prop != 0 and not (a == 0 and b == 0)
+        
+        active_periods = [
+            (period, period_days) for period, period_days in PERIOD_DAYS.items()
+            if any(is_active(*year_params[year][period]) for year in years)
+        ]
         
-        # 为每一天创建收入列
-        for day in range(max_days):
-            col_name = f'day{day}收入'
-            revenues = []
-            
-            for idx, date in enumerate(dates):
-                if idx + day < len(dates):
-                    activation_date = date
-                    revenue_date = date + pd.Timedelta(days=day)
-                    year = activation_date.year
-                    
-                    if day == 0:
-                        # day0收入直接按收入占比分配
-                        revenues.append(base_revenue)
-                    else:
-                        total_revenue = 0
-                        # 计算每种付费周期的收入
-                        for period, (period_days, divisor) in {
-                            'week': (7, 7),
-                            'month': (30, 30),
-                            'quarter': (90, 90),
-                            'year': (365, 365)
-                        }.items():
-                            # 只有在当天是对应周期的付费日时才计算收入
-                            if day % period_days == 0:
-                                a, b, revenue_prop = year_params[year][period]
-                                retention_rate = self.calculate_retention_rate(day, a, b, period)
-                                # 使用收入占比计算该付费方案的基础收入
-                                period_base_revenue = base_revenue * revenue_prop
-                                total_revenue += period_base_revenue * retention_rate
-                                
-                        revenues.append(total_revenue)
-                else:
-                    revenues.append(None)
-                    
-            data[col_name] = revenues
+        # 预先计算续订率表 ret_table[year_idx, period_idx, day]，非付费日为0
+        ret_table = np.zeros((len(years), len(active_periods), max_days))
+        prop_table = np.zeros((len(years), len(active_periods)))
+        for period_idx, (period, period_days) in enumerate(active_periods):
+            # 只有在当天是对应周期的付费日时才计算收入：付费日按步长切片直接得到，无需逐日取模
+            pay_days = days[period_days::period_days]
+            for year_idx, year in enumerate(years):
+                a, b, revenue_prop = year_params[year][period]
+                if not is_active(a, b, revenue_prop):
+                    continue
+                ret_table[year_idx, period_idx, pay_days] = self.calculate_retention_rate(pay_days, a, b, period)
+                prop_table[year_idx, period_idx] = revenue_prop
         
-        df = pd.DataFrame(data, index=dates)
+        # revenue[year_idx, day]: 使用收入占比计算各付费方案收入后求和
+        revenue = base_revenue * np.einsum('yp,ypd->yd', prop_table, ret_table)
+        
+        # day0收入直接按收入占比分配
+        revenue[:, 0] = base_revenue
+        return years, revenue
+
+    def create_revenue_df(self, active_users, start_date, end_date, yearly_params):
+        """创建收入DataFrame"""
+        dates, activation_years = _activation_dates(start_date, end_date)
+        max_days = len(dates)
+        days = np.arange(max_days)
+        years, revenue = self.create_revenue_curves(max_days, yearly_params)
+        
+        # 按激活日期所在年份展开为 (激活日期数, 天数) 的float32矩阵，收入日期超出统计范围的部分置为空
+        # 参数年份是连续的，年份索引可直接由整数相减得到
+        year_idx = activation_years - years[0]
+        in_range = np.arange(len(dates))[:, None] + days < len(dates)
+        revenue_matrix = np.where(in_range, revenue.astype(np.float32)[year_idx], np.float32(np.nan))
+        
+        # 一次性构建DataFrame，避免逐列插入
+        df = pd.DataFrame(revenue_matrix, index=dates, columns=[f'day{day}收入' for day in range(max_days)])
+        # 每日激活人数为常数，作为属性保存而不是重复存储为一列
+        df.attrs['激活人数'] = active_users
         df.index.name = '激活日期'
         return df
 
-def calculate_yearly_rpd(df, start_year, end_year):
-    """计算每年的RPD和增长率（与原代码相同）"""
+    def calculate_yearly_rpd_direct(self, active_users, start_date, end_date, yearly_params):
+        """不构建收入矩阵，直接由各年份收入曲线计算每年的RPD和增长率
+        内存占用为 O(年份数 × 天数)，用于预测天数超过 MAX_MATRIX_DAYS 的长期预测
+        """
+        dates, activation_years = _activation_dates(start_date, end_date)
+        years, revenue = self.create_revenue_curves(len(dates), yearly_params)
+        
+        # cum[year_idx, d] 即该年份激活用户在day0~day d的累计收入
+        cum = np.cumsum(revenue, axis=1)
+        year_idx = activation_years - years[0]
+        return _accumulate_yearly_rpd(cum, year_idx, dates, active_users, activation_years[0], activation_years[-1])
+
+def _activation_dates(start_date, end_date):
+    """生成激活日期数组（datetime64[D]）及每个日期所在的年份"""
+    dates = np.arange(np.datetime64(start_date, 'D'), np.datetime64(end_date, 'D') + np.timedelta64(1, 'D'))
+    years = dates.astype('datetime64[Y]').astype(int) + 1970
+    return dates, years
+
+def _accumulate_yearly_rpd(cum, rows, dates, active_users, start_year, end_year):
+    """由累计收入计算每年的RPD和增长率
+    cum: 累计收入，cum[rows[i], d] 为第i个激活日期在day0~day d的累计收入
+    dates: 激活日期（datetime64[D]）
+    active_users: 每个激活日期的激活人数（标量或数组）
+    """
     results = {}
     
     for year in range(start_year, end_year + 1):
-        mask_cumulative = df.index.year <= year
-        users_cumulative = df[mask_cumulative]['激活人数'].sum()
+        days_until_year_end = (np.datetime64(f'{year}-12-31') - dates).astype(int)
+        mask_cumulative = days_until_year_end >= 0
+        users_cumulative = np.where(mask_cumulative, active_users, 0).sum()
         
-        revenue_cumulative = 0
-        for idx, row in df[mask_cumulative].iterrows():
-            days_until_year_end = (pd.Timestamp(f'{year}-12-31') - idx).days
-            revenue_cols = [f'day{i}收入' for i in range(0, days_until_year_end + 1)]
-            revenue_cumulative += row[revenue_cols].sum()
+        # 过滤与求和合并为一次归约，不再生成筛选后的中间数组
+        last_day = np.clip(days_until_year_end, 0, cum.shape[1] - 1)
+        revenue_cumulative = np.where(mask_cumulative, cum[rows, last_day], 0.0).sum()
         
         rpd_year = revenue_cumulative / users_cumulative
         results[year] = {'RPD': rpd_year}
@@ -144,6 +196,20 @@ def calculate_yearly_rpd(df, start_year, end_year):
     
     return results
 
+def calculate_yearly_rpd(df, start_year, end_year, active_users=None):
+    """计算每年的RPD和增长率
+    df: create_revenue_df 返回的收入DataFrame（仅含各天收入列）
+    active_users: 每日激活人数，默认读取 df.attrs['激活人数']
+    """
+    if active_users is None:
+        active_users = df.attrs['激活人数']
+    
+    # 按行累加各天收入，cum[i, d] 即第i个激活日期在day0~day d的累计收入（以float64累加，避免精度损失）
+    cum = np.nancumsum(df.to_numpy(), axis=1, dtype=np.float64)
+    rows = np.arange(len(df))
+    dates = df.index.to_numpy().astype('datetime64[D]')
+    return _accumulate_yearly_rpd(cum, rows, dates, active_users, start_year, end_year)
+
 def main():
     calculator = RevenueCalculator()
     
@@ -170,7 +236,7 @@ def main():
     )
     
     # 计算RPD
-    results = calculate_yearly_rpd(df, 2023, 2024)
+    results = calculate_yearly_rpd(df, 2023, 2024, active_users=1000)
     return results, df
 
 if __name__ == "__main__":
@@ -1,7 +1,8 @@
+import io
 import streamlit as st
 import pandas as pd
 import numpy as np
-from advanced_rpd import RevenueCalculator, calculate_yearly_rpd, log_power_function, fit_revenue_parameters
+from advanced_rpd import RevenueCalculator, calculate_yearly_rpd, PERIOD_POINTS, MAX_MATRIX_DAYS, cached_fit_parameters
 from datetime import datetime
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
@@ -76,15 +77,45 @@ def create_input_section(year, year_number):
     
     st.markdown("---")  # 添加分隔线
     
+    # 续订率在输入处直接转换为数组，后续计算无需重复转换
     params = {
-        'week': ([week_1, week_3, week_7], week_prop),
-        'month': ([month_1, month_3, month_7], month_prop),
-        'quarter': ([quarter_1, quarter_3, quarter_4], quarter_prop),
-        'year': ([year_1, year_2, year_3], year_prop)
+        'week': (np.array([week_1, week_3, week_7], dtype=np.float64), week_prop),
+        'month': (np.array([month_1, month_3, month_7], dtype=np.float64), month_prop),
+        'quarter': (np.array([quarter_1, quarter_3, quarter_4], dtype=np.float64), quarter_prop),
+        'year': (np.array([year_1, year_2, year_3], dtype=np.float64), year_prop)
     }
     
     return params
 
+def freeze_params(yearly_params):
+    """将年度参数字典转换为不可变的嵌套元组，便于 st.cache_data 快速计算缓存键"""
+    return tuple(
+        (year, tuple((period, (tuple(rates), prop)) for period, (rates, prop) in params.items()))
+        for year, params in sorted(yearly_params.items())
+    )
+
+@st.cache_data(max_entries=2)  # 每个条目是完整的收入矩阵，限制缓存数量以控制内存
+def create_revenue_df_cached(active_users, start_date, end_date, frozen_params):
+    """缓存收入DataFrame的计算结果
+    frozen_params: freeze_params 返回的不可变年度参数
+    """
+    yearly_params = {year: dict(params) for year, params in frozen_params}
+    calculator = RevenueCalculator()
+    return calculator.create_revenue_df(
+        active_users=active_users,
+        start_date=start_date,
+        end_date=end_date,
+        yearly_params=yearly_params
+    )
+
+@st.cache_data(max_entries=2)  # CSV编码结果同样较大，限制缓存数量
+def revenue_csv_cached(active_users, start_date, end_date, frozen_params):
+    """缓存详细数据的CSV编码结果，直接写入 BytesIO 避免生成大字符串"""
+    df = create_revenue_df_cached(active_users, start_date, end_date, frozen_params)
+    buf = io.BytesIO()
+    df.to_csv(buf, index=True, float_format='%.4g', encoding='utf-8')
+    return buf.getvalue()
+
 def plot_retention_curves(yearly_params, launch_date, is_yearly_params):
     """绘制续订率曲线
     yearly_params: 年度参数字典
@@ -108,12 +139,7 @@ def plot_retention_curves(yearly_params, launch_date, is_yearly_params):
     )
 
     # 定义观测点
-    points = {
-        'week': np.array([1, 3, 7]),
-        'month': np.array([1, 3, 7]),
-        'quarter': np.array([1, 3, 4]),
-        'year': np.array([1, 2, 3])
-    }
+    points = PERIOD_POINTS
     
     # 定义最大观察期
     max_periods = {
@@ -126,76 +152,63 @@ def plot_retention_curves(yearly_params, launch_date, is_yearly_params):
     # 定义颜色列表
     colors = ['blue', 'red', 'green', 'purple', 'orange']
     
+    # 需要绘制的年份：所有年份相同时只绘制一条曲线
+    if is_yearly_params == "所有年份相同":
+        plot_years = [launch_date.year]
+    else:
+        plot_years = list(yearly_params.keys())
+    
+    # 收集所有曲线后一次性添加到图中，避免多次调用 add_trace
+    traces = []
+    trace_rows = []
+    
     # 为每种付费方式绘制曲线
     for period_idx, period in enumerate(['week', 'month', 'quarter', 'year'], 1):
         # 生成连续的周期点用于绘制平滑曲线
         x_smooth = np.linspace(1, max_periods[period], 100)
         
-        if is_yearly_params == "所有年份相同":
-            # 获取观测点数据
-            rates = yearly_params[launch_date.year][period][0]
-            
-            # 拟合曲线
-            a, b = fit_revenue_parameters(points[period], np.array(rates))
-            y_smooth = np.exp(log_power_function(x_smooth, a, b))
+        # 拟合各年份曲线，并一次性计算所有年份的平滑曲线 (年份数, 100)
+        rates_list = [yearly_params[year][period][0] for year in plot_years]
+        fitted = np.array([cached_fit_parameters(tuple(rates), period) for rates in rates_list])
+        a_vec, b_vec = fitted[:, 0], fitted[:, 1]
+        y_smooth_all = a_vec[:, None] * np.power(x_smooth[None, :], b_vec[:, None])
+        
+        for i, (year, rates, y_smooth) in enumerate(zip(plot_years, rates_list, y_smooth_all)):
+            if is_yearly_params == "所有年份相同":
+                marker_name = f"{period}付费-观测点"
+                line_name = f"{period}付费-拟合曲线"
+                color = 'blue'
+            else:
+                marker_name = f"{year}年-观测点"
+                line_name = f"{year}年-拟合曲线"
+                color = colors[i]
             
             # 绘制观测点
-            fig.add_trace(
+            traces.append(
                 go.Scatter(
                     x=points[period],
                     y=rates,
                     mode='markers',
-                    name=f"{period}付费-观测点",
-                    marker=dict(size=8, color='blue'),
+                    name=marker_name,
+                    marker=dict(size=8, color=color),
                     showlegend=True if period_idx == 1 else False
-                ),
-                row=period_idx, col=1
+                )
             )
             
             # 绘制拟合曲线
-            fig.add_trace(
+            traces.append(
                 go.Scatter(
                     x=x_smooth,
                     y=y_smooth,
                     mode='lines',
-                    name=f"{period}付费-拟合曲线",
-                    line=dict(color='blue'),
+                    name=line_name,
+                    line=dict(color=color),
                     showlegend=True if period_idx == 1 else False
-                ),
-                row=period_idx, col=1
-            )
-        else:
-            # 为每年绘制不同的曲线
-            for i, year in enumerate(yearly_params.keys()):
-                rates = yearly_params[year][period][0]
-                a, b = fit_revenue_parameters(points[period], np.array(rates))
-                y_smooth = np.exp(log_power_function(x_smooth, a, b))
-                
-                # 绘制观测点
-                fig.add_trace(
-                    go.Scatter(
-                        x=points[period],
-                        y=rates,
-                        mode='markers',
-                        name=f"{year}年-观测点",
-                        marker=dict(size=8, color=colors[i]),
-                        showlegend=True if period_idx == 1 else False
-                    ),
-                    row=period_idx, col=1
-                )
-                
-                # 绘制拟合曲线
-                fig.add_trace(
-                    go.Scatter(
-                        x=x_smooth,
-                        y=y_smooth,
-                        mode='lines',
-                        name=f"{year}年-拟合曲线",
-                        line=dict(color=colors[i]),
-                        showlegend=True if period_idx == 1 else False
-                    ),
-                    row=period_idx, col=1
                 )
+            )
+            trace_rows.extend([period_idx, period_idx])
+    
+    fig.add_traces(traces, rows=trace_rows, cols=[1] * len(traces))
     
     # 更新布局
     fig.update_layout(height=1000)
@@ -307,18 +320,31 @@ def main():
     
     # 计算按钮
     if st.button("计算RPD"):
-        calculator = RevenueCalculator()
-        
         # 使用固定的 active_users = 1000
-        df = calculator.create_revenue_df(
+        df_args = dict(
             active_users=1000,  # 固定值
             start_date=launch_date.strftime("%Y-%m-%d"),
             end_date=f"{end_year}-12-31",
-            yearly_params=yearly_params
+            frozen_params=freeze_params(yearly_params)
         )
+        max_days = (pd.Timestamp(df_args['end_date']) - launch_date).days + 1
         
         # 计算RPD
-        results = calculate_yearly_rpd(df, start_year, end_year)
+        try:
+            if max_days > MAX_MATRIX_DAYS:
+                # 预测期过长时收入矩阵过大，直接由收入曲线计算RPD
+                results = RevenueCalculator().calculate_yearly_rpd_direct(
+                    active_users=df_args['active_users'],
+                    start_date=df_args['start_date'],
+                    end_date=df_args['end_date'],
+                    yearly_params=yearly_params
+                )
+            else:
+                df = create_revenue_df_cached(**df_args)
+                results = calculate_yearly_rpd(df, start_year, end_year, df_args['active_users'])
+        except ValueError as e:
+            st.error(f"参数错误：{e}")
+            return
         
         # 显示结果
         st.header("计算结果")
@@ -350,17 +376,25 @@ def main():
         st.write(f"参数设置模式：{is_yearly_params}")
         
         # 提供下载详细数据的功能
-        st.download_button(
-            label="下载详细数据",
-            data=df.to_csv(index=True).encode('utf-8'),
-            file_name='rpd_detailed_data.csv',
-            mime='text/csv'
-        )
+        if max_days > MAX_MATRIX_DAYS:
+            st.info(f"预测期超过{MAX_MATRIX_DAYS}天，详细数据过大，不提供下载")
+        else:
+            st.download_button(
+                label="下载详细数据",
+                data=revenue_csv_cached(**df_args),
+                file_name='rpd_detailed_data.csv',
+                mime='text/csv'
+            )
         
         # 添加续订率曲线
         st.subheader("续订率曲线")
-        fig = plot_retention_curves(yearly_params, launch_date, is_yearly_params)
-        st.plotly_chart(fig, use_container_width=True)
+        try:
+            fig = plot_retention_curves(yearly_params, launch_date, is_yearly_params)
+        except ValueError as e:
+            # 收入占比为0的方案不参与RPD计算，但绘图时仍需拟合其续订率
+            st.error(f"参数错误：{e}")
+        else:
+            st.plotly_chart(fig, use_container_width=True)
 
 if __name__ == "__main__":
     main()